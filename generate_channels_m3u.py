@@ -2,10 +2,17 @@
 # -*- coding: utf-8 -*-
 
 import re
+import sys
+import codecs
 import argparse
 from pathlib import Path
-from typing import List, Dict
-import requests
+from typing import Iterable, Iterator, List, Dict, Optional, Set, Tuple
+import urllib3
+
+try:
+    import ahocorasick  # optional: pyahocorasick speeds up substring rules
+except ImportError:
+    ahocorasick = None
 
 US_M3U_URL = "https://iptv-org.github.io/iptv/index.m3u"
 OUTPUT_FILE = "channels.m3u"
@@ -20,38 +27,80 @@ PREFER_M3U8  = True
 DEDUP_KEY    = "tvg-id"   # tvg-id | tvg-name | none
 TIMEOUT      = 30
 
-def fetch_text(url: str) -> str:
-    r = requests.get(url, timeout=TIMEOUT, headers={"User-Agent": "IPTV-Filter/1.0"})
-    r.raise_for_status()
-    return r.text
-
-def tokenize_m3u(m3u_text: str) -> List[Dict]:
-    """Return list of items: {attrs: {…}, display: str, url: str}"""
-    items = []
-    lines = [ln.rstrip("\n") for ln in m3u_text.splitlines() if ln.strip()]
-    i = 0
-    while i < len(lines):
-        if lines[i].startswith("#EXTINF"):
-            ext = lines[i]
-            # Find the first non-comment line after EXTINF as the URL
-            j = i + 1
-            while j < len(lines) and lines[j].startswith("#"):
-                j += 1
-            url = lines[j].strip() if j < len(lines) else ""
-
-            m = re.match(r'^#EXTINF:[^ ]*\s*(?P<attrs>.*?),(?P<name>.*)$', ext)
-            attrs_text = m.group("attrs") if m else ""
-            display = (m.group("name").strip() if m else "").strip()
-
-            attrs = {}
-            for key, val in re.findall(r'([A-Za-z0-9\-]+)="([^"]*)"', attrs_text):
-                attrs[key.lower()] = val
-
-            items.append({"attrs": attrs, "display": display, "url": url})
-            i = j + 1
-        else:
-            i += 1
-    return items
+# Attributes written to the output M3U, in order
+M3U_ATTR_ORDER = ("tvg-id", "tvg-name", "tvg-chno", "tvg-language", "tvg-country", "group-title", "tvg-logo")
+
+_EXTINF_RE     = re.compile(r'^#EXTINF:[^ ]*\s*(?P<attrs>.*?),(?P<name>.*)$')
+_ATTR_RE       = re.compile(r'([A-Za-z0-9\-]+)="([^"]*)"')
+_LANG_SPLIT_RE = re.compile(r"[;,/|]")
+_RULE_EXACT_RE = re.compile(r'^([A-Za-z0-9\-]+)=(.+)$')
+_RULE_REGEX_RE = re.compile(r'^([A-Za-z0-9\-]+)~/(.+)/$')
+_URL_SCHEME_RE = re.compile(r'^https?://', re.I)
+
+# Pooled connections are reused across fetches; advertise only encodings urllib3 can decode
+_POOL = urllib3.PoolManager(
+    num_pools=4, maxsize=8,
+    headers=urllib3.make_headers(accept_encoding=True, user_agent="IPTV-Filter/1.0"),
+)
+
+def fetch_lines(url: str) -> Iterator[str]:
+    """Stream the (decompressed) response body line by line instead of buffering it whole."""
+    r = _POOL.request("GET", url, preload_content=False, decode_content=True, timeout=TIMEOUT)
+    try:
+        if r.status >= 400:
+            raise urllib3.exceptions.HTTPError(f"GET {url} failed: HTTP {r.status}")
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        partial = ""
+        for chunk in r.stream(65536):
+            lines = (partial + decoder.decode(chunk)).splitlines(True)
+            # Carry an unterminated last line over to the next chunk
+            partial = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+            yield from lines
+        partial += decoder.decode(b"", final=True)
+        if partial:
+            yield partial
+    finally:
+        r.release_conn()
+
+def source_lines(source: str) -> Iterator[str]:
+    """Yield lines from an M3U URL or local file path."""
+    if _URL_SCHEME_RE.match(source):
+        yield from fetch_lines(source)
+    else:
+        with open(source, "r", encoding="utf-8", errors="ignore") as f:
+            yield from f
+
+def _parse_attrs(attrs_text: str) -> Dict[str, str]:
+    # One C-level findall per line; a hand-rolled str.find scanner benchmarked slower
+    return {key.lower(): val for key, val in _ATTR_RE.findall(attrs_text)} if attrs_text else {}
+
+def _make_item(ext: str, url: str) -> Dict:
+    m = _EXTINF_RE.match(ext)
+    attrs_text = m.group("attrs") if m else ""
+    display = (m.group("name").strip() if m else "").strip()
+    return {"attrs": _parse_attrs(attrs_text), "display": display, "url": url}
+
+def tokenize_m3u_lines(lines: Iterable[str]) -> Iterator[Dict]:
+    """Yield items: {attrs: {…}, display: str, url: str}"""
+    pending_extinf: Optional[str] = None
+    for ln in lines:
+        ln = ln.rstrip("\r\n")
+        if not ln.strip():
+            continue
+        if ln.startswith("#"):
+            # Later #EXTINF lines before a URL are skipped; the first one wins
+            if pending_extinf is None and ln.startswith("#EXTINF"):
+                pending_extinf = ln
+            continue
+        # First non-comment line after EXTINF is its URL
+        if pending_extinf is not None:
+            yield _make_item(pending_extinf, ln.strip())
+            pending_extinf = None
+    if pending_extinf is not None:
+        yield _make_item(pending_extinf, "")
+
+def tokenize_m3u(m3u_text: str) -> Iterator[Dict]:
+    return tokenize_m3u_lines(m3u_text.splitlines())
 
 def norm(s: str) -> str:
     return (s or "").strip().lower()
@@ -60,8 +109,15 @@ def lang_ok(item: Dict) -> bool:
     if not ENGLISH_ONLY:
         return True
     val = item["attrs"].get("tvg-language", "")
-    parts = [norm(p) for p in re.split(r"[;,/|]", val) if p.strip()]
-    return any(p in ALLOWED_LANGS for p in parts) or not val  # keep if blank (US list is mostly English)
+    if not val:
+        return True  # keep if blank (US list is mostly English)
+    v = val.strip().lower()
+    # Fast path: most entries carry a single language value
+    if v in ALLOWED_LANGS:
+        return True
+    if not any(c in v for c in ";,/|"):
+        return False
+    return any(p.strip() in ALLOWED_LANGS for p in _LANG_SPLIT_RE.split(v))
 
 def read_rules(path: Path) -> List[str]:
     if not path.exists():
@@ -75,73 +131,130 @@ def read_rules(path: Path) -> List[str]:
 
 def parse_rule(rule: str):
     # attr=VALUE      (exact, case-insensitive)
-    m = re.match(r'^([A-Za-z0-9\-]+)=(.+)$', rule)
+    m = _RULE_EXACT_RE.match(rule)
     if m:
-        return ("attr_exact", m.group(1).lower(), m.group(2))
+        return ("attr_exact", m.group(1).lower(), norm(m.group(2)))
     # attr~/REGEX/    (regex, case-insensitive)
-    m = re.match(r'^([A-Za-z0-9\-]+)~/(.+)/$', rule)
+    m = _RULE_REGEX_RE.match(rule)
     if m:
-        return ("attr_regex", m.group(1).lower(), m.group(2))
+        try:
+            pat = re.compile(m.group(2), re.I)
+        except re.error as e:
+            print(f"[WARN] Invalid regex in rule {rule!r}: {e}", file=sys.stderr)
+            pat = None  # never matches
+        return ("attr_regex", m.group(1).lower(), pat)
     # substring anywhere (tvg-id, tvg-name, display, group-title)
-    return ("any_substr", "", rule)
+    return ("any_substr", "", norm(rule))
 
-def item_matches(item: Dict, parsed_rule) -> bool:
-    mode, attr, pat = parsed_rule
+def item_view(item: Dict, exact_attrs: Tuple[str, ...]) -> Tuple[Dict[str, str], str, str]:
+    """
+    Normalize an item once for rule matching: (attrs_norm, display_norm, any_hay_norm).
+    Only the attributes named by attr_exact rules (exact_attrs) are normalized.
+    """
     attrs = item["attrs"]
+    display = item["display"]
     any_hay = " || ".join([
         attrs.get("tvg-id", ""),
         attrs.get("tvg-name", ""),
         attrs.get("group-title", ""),
-        item["display"],
+        display,
     ])
+    # Values are always str here, so skip norm()'s None guard in this hot path
+    attrs_norm = {k: attrs[k].strip().lower() for k in exact_attrs if k in attrs}
+    return attrs_norm, display.strip().lower(), any_hay.strip().lower()
 
-    if mode == "attr_exact":
-        val = attrs.get(attr, "") if attr != "display" else item["display"]
-        return norm(val) == norm(pat)
-    if mode == "attr_regex":
-        val = attrs.get(attr, "") if attr != "display" else item["display"]
-        try:
-            return re.search(pat, val or "", re.I) is not None
-        except re.error:
-            return False
-    if mode == "any_substr":
-        return norm(pat) in norm(any_hay)
+def build_rule_index(parsed_rules):
+    """
+    Partition parsed rules into (exact_idx, substr_hit, regex_rules):
+    attr_exact values hashed per attribute, all any_substr needles behind a
+    single matcher (Aho-Corasick when available), and the residual
+    (attr, compiled pattern) regex rules.
+    """
+    exact_idx: Dict[str, Set[str]] = {}
+    substrs: List[str] = []
+    regex_rules = []
+    for mode, attr, pat in parsed_rules:
+        if mode == "attr_exact":
+            exact_idx.setdefault(attr, set()).add(pat)
+        elif mode == "any_substr":
+            substrs.append(pat)
+        elif pat is not None:  # invalid regexes never match
+            regex_rules.append((attr, pat))
+
+    substr_hit = None
+    if substrs and ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for idx, pat in enumerate(substrs):
+            automaton.add_word(pat, idx)
+        automaton.make_automaton()
+        substr_hit = lambda hay: any(automaton.iter(hay))
+    elif substrs:
+        substr_hit = lambda hay: any(pat in hay for pat in substrs)
+    return tuple(exact_idx.items()), substr_hit, tuple(regex_rules)
+
+def index_matches(item: Dict, view, index) -> bool:
+    exact_idx, substr_hit, regex_rules = index
+    attrs_norm, display_norm, any_hay_norm = view
+    for attr, values in exact_idx:
+        val = attrs_norm.get(attr, "") if attr != "display" else display_norm
+        if val in values:
+            return True
+    if substr_hit is not None and substr_hit(any_hay_norm):
+        return True
+    if regex_rules:
+        attrs = item["attrs"]
+        for attr, pat in regex_rules:
+            val = attrs.get(attr, "") if attr != "display" else item["display"]
+            if pat.search(val) is not None:
+                return True
     return False
 
-def apply_lists(items: List[Dict], allow_rules: List[str], deny_rules: List[str]) -> List[Dict]:
-    allow_parsed = [parse_rule(r) for r in allow_rules]
-    deny_parsed  = [parse_rule(r) for r in deny_rules]
+def apply_lists(items: Iterable[Dict], allow_rules: List[str], deny_rules: List[str]) -> List[Dict]:
+    allow_idx = build_rule_index(parse_rule(r) for r in allow_rules) if allow_rules else None
+    deny_idx  = build_rule_index(parse_rule(r) for r in deny_rules) if deny_rules else None
+    if allow_idx is None and deny_idx is None:
+        return [it for it in items if lang_ok(it)]
+    # Attributes any attr_exact rule looks up; item_view normalizes just these
+    exact_attrs = tuple({
+        attr
+        for idx in (allow_idx, deny_idx) if idx is not None
+        for attr, _ in idx[0] if attr != "display"
+    })
     out = []
+    append = out.append
     for it in items:
         if not lang_ok(it):
             continue
+        view = item_view(it, exact_attrs)
         # Allowlist: if provided, item must match at least one
-        if allow_parsed:
-            if not any(item_matches(it, r) for r in allow_parsed):
+        if allow_idx is not None:
+            if not index_matches(it, view, allow_idx):
                 continue
         # Denylist: drop if matches any
-        if deny_parsed and any(item_matches(it, r) for r in deny_parsed):
+        if deny_idx is not None and index_matches(it, view, deny_idx):
             continue
-        out.append(it)
+        append(it)
     return out
 
 def prefer(items: List[Dict]) -> List[Dict]:
     # Prefer https over http, and .m3u8 over other URLs for duplicates (by id/name/display)
-    buckets = {}
-    def key(it):
-        return (it["attrs"].get("tvg-id") or it["attrs"].get("tvg-name") or it["display"]).lower()
+    buckets: Dict[str, List[Dict]] = {}
+    bucket = buckets.setdefault
     for it in items:
-        buckets.setdefault(key(it), []).append(it)
+        attrs = it["attrs"]
+        k = (attrs.get("tvg-id") or attrs.get("tvg-name") or it["display"]).lower()
+        bucket(k, []).append(it)
+    prefer_https, prefer_m3u8 = PREFER_HTTPS, PREFER_M3U8
+    def score(it):
+        s = 0
+        ul = (it["url"] or "").lower()
+        if prefer_https and ul.startswith("https://"): s += 2
+        if prefer_m3u8 and ul.endswith(".m3u8"):       s += 1
+        return s
     result = []
-    for _, lst in buckets.items():
+    for lst in buckets.values():
         # Choose best URL in each bucket
-        def score(u):
-            s = 0
-            if PREFER_HTTPS and u.lower().startswith("https://"): s += 2
-            if PREFER_M3U8 and u.lower().endswith(".m3u8"):      s += 1
-            return s
-        best = max(lst, key=lambda x: score(x["url"] or ""))
-        result.append(best)
+        result.append(lst[0] if len(lst) == 1 else max(lst, key=score))
     return result
 
 def dedup(items: List[Dict], key: str) -> List[Dict]:
@@ -165,16 +278,13 @@ def dedup(items: List[Dict], key: str) -> List[Dict]:
 def write_m3u(items: List[Dict], path: Path):
     lines = ["#EXTM3U"]
     for it in items:
-        attrs = it["attrs"].copy()
+        attrs = it["attrs"]
         # keep some common attrs tidy
-        parts = []
-        for k in ("tvg-id","tvg-name","tvg-chno","tvg-language","tvg-country","group-title","tvg-logo"):
-            v = attrs.get(k)
-            if v:
-                parts.append(f'{k}="{v}"')
+        parts = [f'{k}="{attrs[k]}"' for k in M3U_ATTR_ORDER if attrs.get(k)]
         lines.append(f'#EXTINF:-1 {" ".join(parts)},{it["display"]}')
         lines.append(it["url"] or "")
-    path.write_text("\n".join(lines), encoding="utf-8")
+    # Encode the joined buffer once and write it in a single call (always "\n" line endings)
+    path.write_bytes("\n".join(lines).encode("utf-8"))
 
 def main():
     ap = argparse.ArgumentParser(description="Filter the iptv-org US M3U into your own list.")
@@ -190,8 +300,7 @@ def main():
     if args.no_english_only:
         ENGLISH_ONLY = False
 
-    raw = fetch_text(args.source) if re.match(r"^https?://", args.source, re.I) else Path(args.source).read_text(encoding="utf-8", errors="ignore")
-    items = tokenize_m3u(raw)
+    items = tokenize_m3u_lines(source_lines(args.source))
 
     allow_rules = read_rules(Path(args.allow))
     deny_rules  = read_rules(Path(args.deny))
@@ -17,55 +17,91 @@ Usage:
 """
 
 import argparse
-import glob
+import mmap
 import os
 import re
 import sys
 import xml.etree.ElementTree as ET
-from typing import Iterable, List, Set, Dict, Tuple
-from xml.sax.saxutils import escape as xml_escape
+from concurrent.futures import ProcessPoolExecutor
+from typing import FrozenSet, Iterator, List, Optional, Set, Dict, Tuple
 
-EXTINF_TVG_ID_RE = re.compile(r'tvg-id="([^"]+)"')
+try:
+    from lxml import etree as LET  # optional: libxml2-backed streaming parser
+except ImportError:
+    LET = None
 
-def read_tvg_ids_from_m3u(m3u_path: str) -> List[str]:
-    """Extract tvg-id attributes from #EXTINF lines, preserving order and deduping."""
+_XML_PARSE_ERRORS = (ET.ParseError,) + ((LET.XMLSyntaxError,) if LET is not None else ())
+
+# First tvg-id on each #EXTINF line, matched over the raw file bytes
+EXTINF_TVG_ID_RE = re.compile(rb'^#EXTINF[^\n]*?tvg-id="([^"\n]+)"', re.M)
+
+def read_tvg_ids_from_m3u(m3u_path: str) -> Tuple[List[str], FrozenSet[str]]:
+    """
+    Extract tvg-id attributes from #EXTINF lines, preserving order and deduping.
+    Returns the ordered ids plus a frozenset of them for membership tests.
+    """
     if not os.path.isfile(m3u_path):
         raise FileNotFoundError(f"M3U not found: {m3u_path}")
     tvg_ids: List[str] = []
-    with open(m3u_path, "r", encoding="utf-8", errors="ignore") as f:
-        for line in f:
-            if line.startswith("#EXTINF"):
-                m = EXTINF_TVG_ID_RE.search(line)
-                if m:
-                    val = m.group(1).strip()
-                    if val:
-                        tvg_ids.append(val)
+    if os.path.getsize(m3u_path) == 0:  # mmap cannot map an empty file
+        return tvg_ids, frozenset()
+    with open(m3u_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for m in EXTINF_TVG_ID_RE.finditer(mm):
+            val = m.group(1).decode("utf-8", errors="ignore").strip()
+            if val:
+                tvg_ids.append(val)
     # de-dupe preserving order
-    seen: Set[str] = set()
-    uniq: List[str] = []
-    for x in tvg_ids:
-        if x not in seen:
-            seen.add(x)
-            uniq.append(x)
-    return uniq
-
-def find_channels_files(epg_dir: str) -> List[str]:
-    """Return list of all *.channels.xml files under epg_dir."""
+    uniq = list(dict.fromkeys(tvg_ids))
+    return uniq, frozenset(uniq)
+
+def find_channels_files(epg_dir: str) -> Iterator[str]:
+    """Yield all *.channels.xml files under epg_dir (hidden directories skipped, like glob)."""
     if not os.path.isdir(epg_dir):
         raise NotADirectoryError(f"EPG directory not found: {epg_dir}")
-    pattern = os.path.join(epg_dir, "**", "*.channels.xml")
-    files = glob.glob(pattern, recursive=True)
-    return files
-
-def parse_channels_file(xml_path: str) -> Iterable[ET.Element]:
-    """Yield <channel> elements from a channels.xml file. Skip malformed files."""
+    return _walk_channels_files(epg_dir)
+
+def _walk_channels_files(root: str) -> Iterator[str]:
+    # Iterative pre-order walk; DirEntry.is_dir() uses the cached d_type, so no extra stat per entry
+    stack = [root]
+    while stack:
+        subdirs: List[str] = []
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.endswith(".channels.xml"):
+                        yield entry.path
+        except OSError:
+            continue  # unreadable or vanished directory: skip it, as glob does
+        stack.extend(reversed(subdirs))
+
+def parse_channels_file(xml_path: str) -> Iterator[ET.Element]:
+    """
+    Yield <channel> elements from a channels.xml file as they are parsed.
+    Each element is cleared once the caller moves on, so memory stays flat
+    regardless of file size. Malformed files are skipped from the point of error.
+    """
     try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-        return root.findall(".//channel")
-    except ET.ParseError as e:
+        if LET is not None:
+            for _, el in LET.iterparse(xml_path, events=("end",), tag="channel"):
+                yield el
+                el.clear()
+                while el.getprevious() is not None:
+                    del el.getparent()[0]
+        else:
+            root = None
+            for event, el in ET.iterparse(xml_path, events=("start", "end")):
+                if root is None:
+                    root = el  # first start event is the document root
+                if event == "end" and el.tag == "channel":
+                    yield el
+                    # ElementTree has no parent links, so drop finished children via the root
+                    root.clear()
+    except _XML_PARSE_ERRORS as e:
         print(f"[WARN] XML parse error in {xml_path}: {e}", file=sys.stderr)
-        return []
 
 def render_channel_line(el: ET.Element) -> str:
     """
@@ -73,10 +109,11 @@ def render_channel_line(el: ET.Element) -> str:
     site, lang, xmltv_id, site_id, then text content as element body.
     """
     def attr(name: str) -> str:
-        return (el.attrib.get(name) or "").strip()
+        return (el.get(name) or "").strip()
 
     def esc(v: str) -> str:
-        return xml_escape(v, {'"': "&quot;", "'": "&apos;"})
+        # Inline replace chain: same output as saxutils.escape with quote entities, minus its per-call dict loop
+        return v.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;").replace("'", "&apos;")
 
     site     = esc(attr("site"))
     lang     = esc(attr("lang"))
@@ -86,50 +123,99 @@ def render_channel_line(el: ET.Element) -> str:
 
     return f'<channel site="{site}" lang="{lang}" xmltv_id="{xmltv_id}" site_id="{site_id}">{name}</channel>'
 
-def collect_matches(tvg_ids: Set[str], channels_files: List[str]) -> Tuple[List[str], Set[str]]:
+_scan_tvg_ids: FrozenSet[str] = frozenset()
+
+def _init_scan(tvg_ids: FrozenSet[str]) -> None:
+    """Install the wanted tvg_ids once per worker instead of pickling them per file."""
+    global _scan_tvg_ids
+    _scan_tvg_ids = tvg_ids
+
+def _scan(path: str) -> List[Tuple[str, str]]:
+    """Return (xmltv_id, rendered line) for every wanted <channel> in one file."""
+    hits: List[Tuple[str, str]] = []
+    wanted = _scan_tvg_ids
+    for ch in parse_channels_file(path):
+        xmltv_id = ch.get("xmltv_id")
+        if not xmltv_id:
+            continue
+        if xmltv_id not in wanted:
+            # Ids are rarely padded; only strip on a miss
+            xmltv_id = xmltv_id.strip()
+            if xmltv_id not in wanted:
+                continue
+        hits.append((xmltv_id, render_channel_line(ch)))
+    return hits
+
+def _iter_scans(tvg_ids: FrozenSet[str], channels_files: List[str], jobs: Optional[int]) -> Iterator[List[Tuple[str, str]]]:
+    """
+    Yield _scan results per file, in file order. jobs <= 1 scans in-process;
+    otherwise a process pool is used (None lets the executor pick the worker count).
+    """
+    if jobs is not None and jobs <= 1:
+        _init_scan(tvg_ids)
+        yield from map(_scan, channels_files)
+        return
+    ex = ProcessPoolExecutor(max_workers=jobs, initializer=_init_scan, initargs=(tvg_ids,))
+    try:
+        yield from ex.map(_scan, channels_files, chunksize=4)
+    finally:
+        # Drop still-queued files if the caller stopped early
+        if sys.version_info >= (3, 9):
+            ex.shutdown(cancel_futures=True)
+        else:
+            ex.shutdown()
+
+def collect_matches(tvg_ids: FrozenSet[str], channels_files: List[str], first_only: bool = False, jobs: Optional[int] = 1) -> Tuple[List[str], FrozenSet[str]]:
     """
     Scan all channels files once. Return rendered lines and set of tvg_ids not found.
-    Exact, case-sensitive match on xmltv_id.
+    Exact, case-sensitive match on xmltv_id. Files are parsed in parallel unless jobs <= 1;
+    output order always follows channels_files.
+    With first_only, keep just the first <channel> per xmltv_id and stop scanning
+    as soon as every tvg_id has been matched.
     """
     found_ids: Set[str] = set()
     lines: List[str] = []
+    # Only --first-match consumes ids; otherwise test against the frozenset directly
+    remaining = set(tvg_ids) if first_only else tvg_ids
 
-    for path in channels_files:
-        for ch in parse_channels_file(path):
-            xmltv_id = (ch.attrib.get("xmltv_id") or "").strip()
-            if xmltv_id and xmltv_id in tvg_ids:
-                lines.append(render_channel_line(ch))
+    for hits in _iter_scans(tvg_ids, channels_files, jobs):
+        for xmltv_id, line in hits:
+            if xmltv_id in remaining:
+                lines.append(line)
                 found_ids.add(xmltv_id)
+                if first_only:
+                    remaining.discard(xmltv_id)
+                    if not remaining:
+                        return lines, frozenset()
 
     not_found = tvg_ids - found_ids
     return lines, not_found
 
 def write_channels_list_xml(lines: List[str], out_path: str) -> None:
-    with open(out_path, "w", encoding="utf-8", newline="\n") as f:
-        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        f.write("<channels>\n")
-        for ln in lines:
-            f.write(f"{ln}\n")
-        f.write("</channels>\n")
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>', "<channels>", *lines, "</channels>", ""]
+    with open(out_path, "wb") as f:
+        f.write("\n".join(parts).encode("utf-8"))
 
 def main():
     ap = argparse.ArgumentParser(description="Build channels_list.xml from local iptv-org/epg and an M3U tvg-id list.")
     ap.add_argument("--m3u", required=True, help="Full path to channels.m3u")
     ap.add_argument("--epg-dir", required=True, help="Path to local clone of iptv-org/epg")
     ap.add_argument("--out", default="channels_list.xml", help="Output XML file path")
+    ap.add_argument("--jobs", type=int, default=None, help="Worker processes for parsing channels files (default: CPU count)")
+    ap.add_argument("--first-match", action="store_true", help="Keep only the first site entry per tvg-id and stop scanning once all are found")
     args = ap.parse_args()
 
-    tvg_ids = read_tvg_ids_from_m3u(args.m3u)
+    tvg_ids, tvg_id_set = read_tvg_ids_from_m3u(args.m3u)
     if not tvg_ids:
         print("No tvg-id values found in the provided M3U.", file=sys.stderr)
         sys.exit(2)
 
-    files = find_channels_files(args.epg_dir)
+    files = list(find_channels_files(args.epg_dir))
     if not files:
         print("No *.channels.xml files found under the EPG directory.", file=sys.stderr)
         sys.exit(3)
 
-    lines, not_found = collect_matches(set(tvg_ids), files)
+    lines, not_found = collect_matches(tvg_id_set, files, first_only=args.first_match, jobs=args.jobs)
     write_channels_list_xml(lines, args.out)
 
     print(f"Wrote {args.out} with {len(lines)} matched entries from {len(files)} files.")